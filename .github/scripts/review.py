@@ -1,39 +1,134 @@
 import os
 import json
 import re
+import time
+import random
+import hashlib
+import threading
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from github import Github
-from zhipuai import ZhipuAI
 from dotenv import load_dotenv
 
+MODEL_NAME = "glm-4-flash"
+# 同时发往模型的请求数
+MAX_WORKERS = int(os.getenv('REVIEW_MAX_WORKERS', 4))
+# 单次请求中代码部分的token上限，超过的hunk会被拆分
+MAX_CHUNK_TOKENS = int(os.getenv('REVIEW_MAX_CHUNK_TOKENS', 3000))
+MAX_RETRIES = int(os.getenv('REVIEW_MAX_RETRIES', 5))
+CACHE_PATH = os.getenv('REVIEW_CACHE_PATH', '.review_cache/cache.json')
+# 最终提交的评论数，按严重程度取前K条
+MAX_COMMENTS = int(os.getenv('REVIEW_MAX_COMMENTS', 3))
+# 提示词或返回格式变化时加一，使旧的缓存失效
+PROMPT_VERSION = 2
+
+IGNORE_EXTENSIONS = ['.md', '.txt', '.json', '.yaml', '.yml', '.ipynb', '.csv', '.lock', '.svg',
+                     '.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.gz', '.pkl', '.npz',
+                     '.h5', '.keras', '.tflite', '.parquet', '.so', '.rlib', '.min.js', '.map']
+GENERATED_PATTERNS = [r'(^|/)(package-lock\.json|Cargo\.lock|poetry\.lock|yarn\.lock)$',
+                      r'_pb2(_grpc)?\.py$', r'(^|/)(dist|build|vendor|node_modules)/']
+GENERATED_MARKERS = ('@generated', 'DO NOT EDIT', 'auto-generated', 'autogenerated')
+
+
+def estimate_tokens(text):
+    """粗略估算token数，中英文混合按每3个字符一个token计算"""
+    return len(text) // 3 + 1
+
+
+class ReviewCache:
+    """
+    评审结果缓存，键为新增代码块内容的哈希
+    保存在JSON文件中，由workflow在多次push之间恢复
+    """
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Ignoring unreadable review cache: {str(e)}")
+
+    @staticmethod
+    def key(code_lines):
+        content = f"{MODEL_NAME}\n{PROMPT_VERSION}\n" + '\n'.join(code_lines)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            with open(self.path, 'w') as f:
+                json.dump(self.entries, f)
+
+
 class CodeReviewer:
-    def __init__(self):
+    def __init__(self, client=None, gh=None, repo=None, cache=None):
+        """
+        client: 兼容ZhipuAI的客户端（chat.completions.create），默认按环境变量创建
+                设置ZHIPU_BASE_URL可指向本地的模拟服务器
+        """
         load_dotenv()
-        
-        self.gh = Github(os.getenv('GITHUB_TOKEN'))
-        self.api_key = os.getenv('ZHIPU_API_KEY')
-        self.client = ZhipuAI(api_key=self.api_key)
-        self.repo_name = os.getenv('GITHUB_REPOSITORY')
-        if not self.repo_name:
-            raise ValueError("GITHUB_REPOSITORY environment variable is not set.")
-        self.repo = self.gh.get_repo(self.repo_name)
-
-    def extract_added_lines(self, patch):
+
+        if client is None:
+            from zhipuai import ZhipuAI
+            self.api_key = os.getenv('ZHIPU_API_KEY')
+            base_url = os.getenv('ZHIPU_BASE_URL')
+            client = ZhipuAI(api_key=self.api_key, base_url=base_url) if base_url else ZhipuAI(api_key=self.api_key)
+        self.client = client
+        self.cache = cache if cache is not None else ReviewCache()
+
+        if repo is None:
+            self.gh = gh or Github(os.getenv('GITHUB_TOKEN'))
+            self.repo_name = os.getenv('GITHUB_REPOSITORY')
+            if not self.repo_name:
+                raise ValueError("GITHUB_REPOSITORY environment variable is not set.")
+            repo = self.gh.get_repo(self.repo_name)
+        self.repo = repo
+
+    def iter_patch_lines(self, patch):
+        """逐行遍历patch，不把整个patch拆成列表"""
+        start = 0
+        while start < len(patch):
+            end = patch.find('\n', start)
+            if end == -1:
+                end = len(patch)
+            yield patch[start:end]
+            start = end + 1
+
+    def iter_hunks(self, patch):
         """
-        从patch中提取新增的代码行及其行号
-        返回: [(行号, 代码行, position)]
+        从patch中按hunk提取新增的代码行及其行号，逐个hunk生成
+        生成: [(行号, 代码行, position), ...]
         """
         if not patch:
-            return []
+            return
 
-        lines = patch.split('\n')
         added_lines = []
         current_line = 0
         position = 0
         
-        for line in lines:
+        for line in self.iter_patch_lines(patch):
             position += 1
             
             if line.startswith('@@'):
+                if added_lines:
+                    yield added_lines
+                    added_lines = []
                 # 提取hunk的起始行号
                 match = re.match(r'@@ -\d+(?:,\d+)? \+(\d+)', line)
                 if match:
@@ -47,7 +142,42 @@ class CodeReviewer:
             elif not line.startswith('-') and not line.startswith('\\'): 
                 current_line += 1
 
-        return added_lines
+        if added_lines:
+            yield added_lines
+
+    def split_chunks(self, hunk, max_tokens=MAX_CHUNK_TOKENS):
+        """将过大的hunk按token上限拆分成多个块，逐块生成"""
+        current_chunk = []
+        current_tokens = 0
+        for added in hunk:
+            tokens = estimate_tokens(added[1]) + 2
+            if current_chunk and current_tokens + tokens > max_tokens:
+                yield current_chunk
+                current_chunk = []
+                current_tokens = 0
+            current_chunk.append(added)
+            current_tokens += tokens
+        if current_chunk:
+            yield current_chunk
+
+    def iter_chunks(self, files):
+        """
+        遍历所有需要评审的文件的代码块
+        生成: (文件序号, 文件名, 代码块)
+        """
+        for file_index, file in enumerate(files):
+            if not self._should_review_file(file.filename):
+                continue
+            # GitHub不会给二进制文件和过大的文件提供patch
+            if not file.patch:
+                continue
+            hunks = self.iter_hunks(file.patch)
+            first_hunk = next(hunks, None)
+            if first_hunk is None or self._is_generated(first_hunk):
+                continue
+            for hunk in itertools.chain([first_hunk], hunks):
+                for chunk in self.split_chunks(hunk):
+                    yield file_index, file.filename, chunk
 
     def get_review_prompt(self, added_lines):
         code_text = '\n'.join([f"行{line[0]}: {line[1]}" for line in added_lines])
@@ -60,6 +190,7 @@ class CodeReviewer:
                         "comments": [
                             {{
                                 "line_number": <行号>,
+                                "severity": <严重程度，1到5的整数，5表示最严重>,
                                 "comment": "<具体的改进建议，包括原因和建议的改进方式>"
                             }},
                             ...
@@ -70,78 +201,145 @@ class CodeReviewer:
                     2. 评论要具体且有建设性
                     3. 只评论新增的代码行
                     4. 返回的必须是合法的JSON格式
+                    5. severity: 5=错误或安全问题，3=性能或可维护性问题，1=风格问题
                     """
 
-    def analyze_code(self, added_lines):
-        if not added_lines:
-            return {"comments": []}
-            
-        response = self.client.chat.completions.create(
-            model="glm-4-flash",
-            messages=[
-                {"role": "system", "content": "你是一个经验丰富的代码审查专家。"},
-                {"role": "user", "content": self.get_review_prompt(added_lines)}
-            ],
-            temperature=0.3,
-            top_p=0.85,
-            stream=False
-        )
-        
+    def _is_retryable(self, error):
+        """限流(429)、服务端错误和网络超时可以重试"""
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status is not None:
+            return status == 429 or status >= 500
+        message = str(error).lower()
+        return any(word in message for word in ('rate limit', 'timeout', 'timed out', 'connection'))
+
+    def _retry_after(self, error):
+        """服务端在Retry-After头中给出的等待秒数"""
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            return float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def _create_completion(self, prompt):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return self.client.chat.completions.create(
+                    model=MODEL_NAME,
+                    messages=[
+                        {"role": "system", "content": "你是一个经验丰富的代码审查专家。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.3,
+                    top_p=0.85,
+                    stream=False
+                )
+            except Exception as e:
+                if attempt == MAX_RETRIES or not self._is_retryable(e):
+                    raise
+                # 指数退避加随机抖动，避免并发的请求同时重试
+                delay = self._retry_after(e) or min(60, 2 ** attempt) + random.uniform(0, 1)
+                print(f"Request failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _request_review(self, added_lines):
+        """请求模型评审，解析失败时抛出异常，以免把失败结果写入缓存"""
+        response = self._create_completion(self.get_review_prompt(added_lines))
+        content = response.choices[0].message.content.strip()
+        if content.startswith('```json'):
+            content = content[len('```json'):].strip()
+        if content.endswith('```'):
+            content = content[:-len('```')].strip()
         try:
-            content = response.choices[0].message.content.strip()
-            if content.startswith('```json'):
-                content = content[len('```json'):].strip()
-            if content.endswith('```'):
-                content = content[:-len('```')].strip()
             return json.loads(content)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response: {str(e)}")
+        except json.JSONDecodeError:
             print(f"Raw response: {content}")
-            return {"comments": []}
-        except Exception as e:
-            print(f"Unexpected error: {str(e)}")
-            return {"comments": []}
+            raise
 
-    def review_pr(self):
+    def review_chunk(self, chunk):
+        """
+        评审一个代码块，内容相同的块直接使用缓存结果
+        缓存中记录评论对应的是块内第几行，因此代码块移动位置后仍然可用
+        返回: [(行号, 严重程度, 评论)]
+        """
+        code_lines = [line[1] for line in chunk]
+        key = self.cache.key(code_lines)
+        cached = self.cache.get(key)
+        if cached is None:
+            index_of_line = {line[0]: index for index, line in enumerate(chunk)}
+            result = self._request_review(chunk)
+            cached = []
+            for comment in result.get('comments', []):
+                index = index_of_line.get(comment.get('line_number'))
+                if index is not None and comment.get('comment'):
+                    cached.append({'index': index, 'severity': self._severity(comment),
+                                   'comment': comment['comment']})
+            self.cache.set(key, cached)
+        return [(chunk[item['index']][0], item['severity'], item['comment']) for item in cached]
+
+    def _severity(self, comment):
+        try:
+            return min(5, max(1, int(comment.get('severity', 1))))
+        except (TypeError, ValueError):
+            return 1
+
+    def get_pr_number(self):
         pr_number = int(os.getenv('GITHUB_EVENT_NUMBER', 0))
         if pr_number == 0:
             with open(os.getenv('GITHUB_EVENT_PATH')) as f:
                 event_data = json.load(f)
                 pr_number = event_data['pull_request']['number']
+        return pr_number
 
-        pr = self.repo.get_pull(pr_number)
-        files = pr.get_files()
-        all_review_comments = []
-        
-        for file in files:
-            if not self._should_review_file(file.filename):
-                continue
+    def collect_comments(self, files, max_comments=MAX_COMMENTS):
+        """
+        并发评审所有文件的代码块，只保留最严重的max_comments条评论
+        同样严重时文件和位置靠前的优先
+        """
+        # 小顶堆，堆顶是当前保留的评论中最不重要的一条
+        top_comments = []
+        counter = itertools.count()
 
+        def collect(future, file_index, filename, chunk):
             try:
-                # 提取新增的代码行
-                added_lines = self.extract_added_lines(file.patch)
-                if not added_lines:
-                    continue
-
-                # 创建行号到position的映射
-                line_to_position = {line[0]: line[2] for line in added_lines}
-                
-                # 分析代码并获取评论
-                review_result = self.analyze_code(added_lines)
-                
-                for comment in review_result.get('comments', []):
-                    line_number = comment['line_number']
-                    if line_number in line_to_position:
-                        all_review_comments.append({
-                            'path': file.filename,
-                            'position': line_to_position[line_number],
-                            'body': comment['comment']
-                        })
+                comments = future.result()
             except Exception as e:
-                print(f"Error reviewing file {file.filename}: {str(e)}")
-        
-        # 只取总共最重要的3条评论
-        review_comments = all_review_comments[:3]
+                print(f"Error reviewing file {filename}: {str(e)}")
+                return
+            # 行号到position的映射
+            line_to_position = {line[0]: line[2] for line in chunk}
+            for line_number, severity, body in comments:
+                position = line_to_position[line_number]
+                item = ((severity, -file_index, -position), next(counter), {
+                    'path': filename,
+                    'position': position,
+                    'body': body
+                })
+                if len(top_comments) < max_comments:
+                    heapq.heappush(top_comments, item)
+                elif item[0] > top_comments[0][0]:
+                    heapq.heapreplace(top_comments, item)
+
+        # 限制排队中的代码块数量，大PR的代码块不会一次全部留在内存里
+        running = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            for job in self.iter_chunks(files):
+                if len(running) >= MAX_WORKERS * 2:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, *running.pop(future))
+                running[pool.submit(self.review_chunk, job[2])] = job
+            for future in list(running):
+                collect(future, *running.pop(future))
+        self.cache.save()
+
+        return [item[2] for item in sorted(top_comments, reverse=True)]
+
+    def review_pr(self):
+        pr = self.repo.get_pull(self.get_pr_number())
+        # 只取总共最重要的几条评论
+        review_comments = self.collect_comments(pr.get_files())
         
         if review_comments:
             try:
@@ -158,8 +356,14 @@ class CodeReviewer:
                 print(json.dumps(review_comments, indent=2))
 
     def _should_review_file(self, filename):
-        ignore_extensions = ['.md', '.txt', '.json', '.yaml', '.yml']
-        return not any(filename.endswith(ext) for ext in ignore_extensions)
+        if any(filename.lower().endswith(ext) for ext in IGNORE_EXTENSIONS):
+            return False
+        return not any(re.search(pattern, filename) for pattern in GENERATED_PATTERNS)
+
+    def _is_generated(self, hunk):
+        """文件开头几行带有生成标记的视为自动生成的文件"""
+        header = [line[1] for line in hunk[:5] if line[0] <= 5]
+        return any(marker in line for line in header for marker in GENERATED_MARKERS)
 
 def main():
     reviewer = CodeReviewer()
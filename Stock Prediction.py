@@ -5,6 +5,11 @@ import math
 import yfinance as yf
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.metrics import mean_squared_error
+from runtime_config import configure_runtime, resolve_batch_size
+
+# Threads, oneDNN and cpu affinity have to be set before keras starts TensorFlow
+configure_runtime()
+
 from keras.models import Sequential
 from keras.layers import Dense, Activation, LSTM, Dropout
 from keras import preprocessing
@@ -100,7 +105,7 @@ jeff_LSTM.add(Dense(units = 1))
 
 
 jeff_LSTM.compile(optimizer = 'adam', loss = 'mean_squared_error')
-jeff_LSTM.fit(x_train, y_train, epochs = 100, batch_size = 32)
+jeff_LSTM.fit(x_train, y_train, epochs = 100, batch_size = resolve_batch_size(jeff_LSTM, x_train, y_train))
 
 data_train = aapl_prices.iloc[:3000, 3]
 data_test = aapl_prices.iloc[:, 3]
@@ -115,7 +120,7 @@ x_test = np.array(x_test)
 x_test = np.reshape(x_test, (x_test.shape[0], x_test.shape[1], 1))
 print(x_test.shape)
 
-predicted_price = jeff_LSTM.predict(x_test)
+predicted_price = jeff_LSTM.predict(x_test, batch_size = resolve_batch_size(jeff_LSTM, x_test))
 predicted_price = scaler.inverse_transform(predicted_price)
 
 #Reformat the data for MSE calculation
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+EXCHANGE_TZ = 'America/New_York'
+
+
+def _local_ns(timestamps, tz=EXCHANGE_TZ):
+    """Exchange wall-clock time of each timestamp as int64 nanoseconds."""
+    index = pd.DatetimeIndex(timestamps)
+    if index.tz is not None:
+        index = index.tz_convert(tz).tz_localize(None)
+    return index.as_unit('ns').asi8
+
+
+class TradingCalendar:
+    """
+    Trading sessions and bars as integer ids.
+
+    Bar ids count the bars of every session in time order, so two bars are
+    `k` bars apart exactly when their ids differ by `k`, no matter how many
+    nights, weekends or holidays lie between them. The lookup arrays are
+    built once; mapping timestamps to ids is a single searchsorted and
+    aligning series by id is plain array indexing.
+    """
+
+    def __init__(self, bar_ns, session_of_bar, session_ns, tz=EXCHANGE_TZ):
+        self.tz = tz
+        # Exchange wall-clock time of each bar, sorted
+        self.bar_ns = bar_ns
+        # Session id of each bar
+        self.session_of_bar = session_of_bar
+        # Midnight of each session date
+        self.session_ns = session_ns
+        # First bar id of each session, and position of every bar inside its session
+        self.session_start = np.searchsorted(session_of_bar, np.arange(len(session_ns)))
+        self.session_end = np.append(self.session_start[1:], len(bar_ns))
+        self.bar_in_session = np.arange(len(bar_ns)) - self.session_start[session_of_bar]
+
+    @classmethod
+    def from_index(cls, *indexes, tz=EXCHANGE_TZ):
+        """
+        Build the calendar from observed bar timestamps, e.g. the price
+        index of one or more tickers. A session is a date with at least one
+        bar; its bars are the regular times of day seen anywhere in the data
+        between that session's first and last bar, so holidays are skipped,
+        early closes stay short and bars missing inside a session are gaps.
+        """
+        local = np.unique(np.concatenate([_local_ns(index, tz) for index in indexes]))
+        day = np.int64(24 * 3600 * 10**9)
+        dates = local - local % day
+        time_of_day = local - dates
+        grid = np.unique(time_of_day)
+
+        session_ns, first = np.unique(dates, return_index=True)
+        last = np.append(first[1:], len(local)) - 1
+        lo = np.searchsorted(grid, time_of_day[first])
+        hi = np.searchsorted(grid, time_of_day[last], side='right')
+
+        counts = hi - lo
+        session_of_bar = np.repeat(np.arange(len(session_ns)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        bar_ns = session_ns[session_of_bar] + grid[np.repeat(lo, counts) + offset]
+        return cls(bar_ns, session_of_bar, session_ns, tz)
+
+    def __len__(self):
+        return len(self.bar_ns)
+
+    @property
+    def n_sessions(self):
+        return len(self.session_ns)
+
+    def bar_ids(self, timestamps):
+        """Bar id of each timestamp, -1 for timestamps that are not a bar of the calendar."""
+        local = _local_ns(timestamps, self.tz)
+        position = np.searchsorted(self.bar_ns, local)
+        position[position == len(self.bar_ns)] = 0
+        return np.where(self.bar_ns[position] == local, position, -1)
+
+    def session_bars(self, session):
+        """Bar ids of one session."""
+        return np.arange(self.session_start[session], self.session_end[session])
+
+    def session_ids(self, bar_ids):
+        return self.session_of_bar[bar_ids]
+
+    def timestamps(self, bar_ids):
+        """Timestamps of the given bar ids in the exchange time zone."""
+        return pd.DatetimeIndex(self.bar_ns[bar_ids]).tz_localize(self.tz)
+
+    def window_mask(self, bar_ids, window, cross_sessions=True):
+        """
+        For the windows cut by pipeline.make_windows from a series with these
+        bar ids (inputs k..k+window-1, target k+window), True where the
+        window has no missing bar. With cross_sessions=False the window
+        must also lie inside a single session.
+        """
+        bar_ids = np.asarray(bar_ids)
+        first, target = bar_ids[:-window], bar_ids[window:]
+        mask = (target - first == window) & (first >= 0)
+        if not cross_sessions:
+            mask &= self.session_of_bar[first] == self.session_of_bar[target]
+        return mask
+
+    def to_dense(self, bar_ids, values, fill=np.nan):
+        """Values placed on the full bar grid, `fill` where a bar has no value."""
+        values = np.asarray(values, dtype=np.float64)
+        dense = np.full((len(self.bar_ns),) + values.shape[1:], fill)
+        valid = bar_ids >= 0
+        dense[bar_ids[valid]] = values[valid]
+        return dense
+
+    def align(self, bar_ids_a, values_a, bar_ids_b, values_b):
+        """Pairs of values that fall on the same bar, returned as (bar_ids, a, b)."""
+        dense_a = self.to_dense(bar_ids_a, values_a)
+        dense_b = self.to_dense(bar_ids_b, values_b)
+        common = np.flatnonzero(~np.isnan(dense_a) & ~np.isnan(dense_b))
+        return common, dense_a[common], dense_b[common]
+
+    def join(self, series_by_ticker):
+        """Join several tickers' series onto the calendar, NaN where a ticker has no bar."""
+        columns = {}
+        for ticker, series in series_by_ticker.items():
+            columns[ticker] = self.to_dense(self.bar_ids(series.index), series.to_numpy())
+        return pd.DataFrame(columns, index=self.timestamps(np.arange(len(self.bar_ns))))
@@ -3,6 +3,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.metrics import mean_squared_error
+from runtime_config import configure_runtime, resolve_batch_size
+
+# Threads, oneDNN and cpu affinity have to be set before keras starts TensorFlow
+configure_runtime()
+
 from keras.models import Sequential
 from keras.layers import LSTM, Dropout, Dense
 import yfinance as yf
@@ -53,7 +58,7 @@ model.add(Dropout(0.2))
 model.add(Dense(units=1))
 
 model.compile(optimizer='adam', loss='mean_squared_error')
-model.fit(x_train, y_train, epochs=100, batch_size=32)
+model.fit(x_train, y_train, epochs=100, batch_size=resolve_batch_size(model, x_train, y_train))
 
 # Prepare test data
 test_data = scaled_data[3000:, :]
@@ -65,7 +70,7 @@ x_test = np.array(x_test)
 x_test = np.reshape(x_test, (x_test.shape[0], x_test.shape[1], 1))
 
 # Predicting the prices
-predicted_prices = model.predict(x_test)
+predicted_prices = model.predict(x_test, batch_size=resolve_batch_size(model, x_test))
 predicted_prices = scaler.inverse_transform(predicted_prices)
 
 # Reformat the data for MSE calculation
@@ -0,0 +1,240 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pipeline import EPOCHS, load_windows
+from runtime_config import available_cpus, set_cpu_affinity
+
+# Every model works on the cached windows of pipeline.features:
+# x of shape (samples, window, 1) with scaled close prices, y the next value.
+
+
+class NaiveLastValue:
+    """Predicts the last close of the window."""
+
+    def fit(self, x, y):
+        return self
+
+    def predict(self, x):
+        return x[:, -1, 0]
+
+
+class EWMA:
+    """Exponentially weighted mean of the window, newest bar weighted most."""
+
+    def __init__(self, span=10):
+        self.alpha = 2.0 / (span + 1)
+
+    def fit(self, x, y):
+        window = x.shape[1]
+        weights = (1 - self.alpha) ** np.arange(window - 1, -1, -1)
+        self.weights = weights / weights.sum()
+        return self
+
+    def predict(self, x):
+        return x[:, :, 0] @ self.weights
+
+
+class RidgeLagged:
+    """Ridge regression on the lagged values of the window."""
+
+    def __init__(self, alpha=1.0):
+        from sklearn.linear_model import Ridge
+        self.model = Ridge(alpha=alpha)
+
+    def fit(self, x, y):
+        self.model.fit(x[:, :, 0], y)
+        return self
+
+    def predict(self, x):
+        return self.model.predict(x[:, :, 0])
+
+
+def window_features(x, lags=10):
+    """Last lags, returns and summary statistics of each window for tree models."""
+    values = x[:, :, 0]
+    last = values[:, -1:]
+    recent = values[:, -lags:]
+    return np.hstack([
+        recent,
+        recent - last,
+        values.mean(axis=1, keepdims=True) - last,
+        values.std(axis=1, keepdims=True),
+        values.max(axis=1, keepdims=True) - last,
+        values.min(axis=1, keepdims=True) - last,
+    ])
+
+
+class GradientBoostedTrees:
+    """
+    Histogram gradient boosting on window features. Trees cannot extrapolate
+    a price level, so they learn the change from the last value instead.
+    """
+
+    def __init__(self, max_iter=200, learning_rate=0.05):
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        self.model = HistGradientBoostingRegressor(max_iter=max_iter, learning_rate=learning_rate)
+
+    def fit(self, x, y):
+        self.model.fit(window_features(x), y - x[:, -1, 0])
+        return self
+
+    def predict(self, x):
+        return x[:, -1, 0] + self.model.predict(window_features(x))
+
+
+class StackedLSTM:
+    """The stacked LSTM of the pipeline."""
+
+    def __init__(self, epochs=EPOCHS):
+        self.epochs = epochs
+
+    def fit(self, x, y):
+        from pipeline import build_lstm
+        from runtime_config import resolve_batch_size
+
+        self.model = build_lstm(x.shape[1])
+        self.model.fit(x, y, epochs=self.epochs, batch_size=resolve_batch_size(self.model, x, y), verbose=0)
+        return self
+
+    def predict(self, x):
+        return self.model.predict(x, batch_size=256, verbose=0).ravel()
+
+
+MODELS = {
+    'naive': NaiveLastValue,
+    'ewma': EWMA,
+    'ridge': RidgeLagged,
+    'gbt': GradientBoostedTrees,
+    'lstm': StackedLSTM,
+}
+
+
+def _pin_worker(slices):
+    """
+    Pool initializer: take a cpu slice of its own and size every thread
+    pool to it, so models timed side by side do not compete for cores.
+    """
+    cpus = slices.get()
+    set_cpu_affinity(cpus)
+    # Read by runtime_config when the LSTM job starts TensorFlow
+    os.environ['STOCK_CPU_AFFINITY'] = ','.join(map(str, cpus))
+    os.environ['STOCK_INTRA_OP_THREADS'] = str(len(cpus))
+    os.environ['STOCK_INTER_OP_THREADS'] = '1'
+    try:
+        # numpy is already loaded, resize its BLAS/OpenMP pools in place
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(len(cpus))
+    except ImportError:
+        pass
+
+
+def run_model(name, ticker, artifacts, latency_repeats=20):
+    """Fit one model on a ticker's cached windows and measure accuracy and timings."""
+    windows = load_windows(artifacts, ticker)
+    x_train, y_train = windows['x_train'], windows['y_train']
+    x_test, y_test = windows['x_test'], windows['y_test']
+
+    model = MODELS[name]()
+    start = time.perf_counter()
+    model.fit(x_train, y_train)
+    train_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted = np.asarray(model.predict(x_test)).ravel()
+    batch_time = time.perf_counter() - start
+
+    # Latency of a single window, as in live prediction
+    single = []
+    for i in range(latency_repeats):
+        start = time.perf_counter()
+        model.predict(x_test[i % len(x_test):i % len(x_test) + 1])
+        single.append(time.perf_counter() - start)
+
+    # MSE in price units, the windows are min-max scaled
+    error = (predicted - y_test) / windows['scale']
+    return {
+        'ticker': ticker,
+        'model': name,
+        'mse': float(np.mean(error ** 2)),
+        'train_s': train_time,
+        'batch_us_per_sample': batch_time / len(x_test) * 1e6,
+        'latency_ms': float(np.median(single)) * 1e3,
+        'cpus': len(available_cpus()),
+    }
+
+
+def run_zoo(tickers, artifacts, models=tuple(MODELS), workers=None):
+    """
+    Run every model on every ticker in parallel processes, return one result
+    per pair. Each worker is pinned to its own equal slice of the cpus, so
+    the timings of a model do not depend on what runs next to it.
+    """
+    jobs = [(name, ticker) for ticker in tickers for name in models]
+    cpus = available_cpus()
+    workers = max(1, min(workers or len(jobs), len(jobs), len(cpus)))
+
+    context = multiprocessing.get_context('spawn')
+    slices = context.Queue()
+    for part in np.array_split(cpus, workers):
+        slices.put([int(cpu) for cpu in part])
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_pin_worker, initargs=(slices,)) as pool:
+        futures = {pool.submit(run_model, name, ticker, artifacts): (name, ticker) for name, ticker in jobs}
+        results = []
+        for future, (name, ticker) in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error running {name} on {ticker}: {str(e)}")
+    return results
+
+
+def print_report(results, reference='lstm'):
+    """
+    Accuracy-vs-train-time and accuracy-vs-latency per ticker, with each
+    model's MSE and speed relative to the reference model.
+    """
+    if results:
+        # Models run side by side, each timing covers only its worker's cpu slice
+        counts = sorted({r['cpus'] for r in results})
+        pinned = str(counts[0]) if len(counts) == 1 else f"{counts[0]}-{counts[-1]}"
+        print(f"Timings are per worker pinned to its own slice of {pinned} cpus")
+    for ticker in dict.fromkeys(r['ticker'] for r in results):
+        rows = sorted((r for r in results if r['ticker'] == ticker), key=lambda r: r['mse'])
+        ref = next((r for r in rows if r['model'] == reference), None)
+        print(f"\n{ticker}")
+        print(f"{'model':<8}{'MSE':>12}{'MSE/ref':>9}{'train s':>10}{'train x':>10}"
+              f"{'us/sample':>11}{'latency ms':>12}{'latency x':>11}")
+        for r in rows:
+            if ref:
+                mse_ratio = f"{r['mse'] / ref['mse']:.2f}"
+                train_x = f"{ref['train_s'] / max(r['train_s'], 1e-9):.0f}"
+                latency_x = f"{ref['latency_ms'] / max(r['latency_ms'], 1e-9):.0f}"
+            else:
+                mse_ratio = train_x = latency_x = '-'
+            print(f"{r['model']:<8}{r['mse']:>12.4f}{mse_ratio:>9}{r['train_s']:>10.2f}{train_x:>10}"
+                  f"{r['batch_us_per_sample']:>11.2f}{r['latency_ms']:>12.3f}{latency_x:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare baseline models with the LSTM on the cached windows")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--artifacts', default='artifacts', help="directory with the features stage output")
+    parser.add_argument('--models', default=','.join(MODELS), help="comma separated models to run")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    models = [name for name in args.models.split(',') if name]
+    unknown = [name for name in models if name not in MODELS]
+    if unknown:
+        parser.error(f"Unknown models: {', '.join(unknown)}")
+    print_report(run_zoo(args.tickers, args.artifacts, models, args.workers))
+
+
+if __name__ == "__main__":
+    main()
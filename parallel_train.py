@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import queue
+import socket
+import tempfile
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from pipeline import EPOCHS, load_windows
+from runtime_config import available_cpus
+
+# Data-parallel training on one host: N worker processes form a
+# MultiWorkerMirroredStrategy cluster over localhost. Each worker trains on
+# its own shard of the windows and gradients are all-reduced, so the
+# weights stay identical on all workers.
+
+
+def _free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def load_training_windows(artifacts, tickers, index=0, n_workers=1):
+    """
+    Training windows of several tickers from the window store, concatenated.
+    With n_workers only the windows of shard `index` are kept (every
+    n_workers-th window, interleaved across tickers), sliced ticker by
+    ticker so no process ever holds all windows.
+    """
+    xs, ys = [], []
+    seen = 0
+    for ticker in tickers:
+        windows = load_windows(artifacts, ticker)
+        start = (index - seen) % n_workers
+        xs.append(windows['x_train'][start::n_workers].copy())
+        ys.append(windows['y_train'][start::n_workers].copy())
+        seen += len(windows['x_train'])
+    # Equal shards so every worker runs the same number of steps
+    per_worker = seen // n_workers
+    return np.concatenate(xs)[:per_worker], np.concatenate(ys)[:per_worker]
+
+
+def _worker(index, ports, tickers, artifacts, epochs, batch_size, cpus, save_path, results):
+    n_workers = len(ports)
+    # TF_CONFIG and the thread settings must be in place before TF starts
+    os.environ['TF_CONFIG'] = json.dumps({
+        'cluster': {'worker': [f"localhost:{port}" for port in ports]},
+        'task': {'type': 'worker', 'index': index},
+    })
+    if cpus:
+        os.environ['STOCK_CPU_AFFINITY'] = ','.join(map(str, cpus))
+        os.environ['STOCK_INTRA_OP_THREADS'] = str(len(cpus))
+
+    from pipeline import build_lstm, ensure_runtime
+    ensure_runtime()
+    import tensorflow as tf
+    from keras.callbacks import Callback
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    x, y = load_training_windows(artifacts, tickers, index, n_workers)
+
+    # The data is sharded already, tf.data must not shard it again. The
+    # dataset is built per worker, so each batch stays at batch_size instead
+    # of being split across the workers as a global batch
+    def dataset_fn(input_context):
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+        return (tf.data.Dataset.from_tensor_slices((x, y))
+                .shuffle(len(x), seed=index)
+                .repeat()
+                .batch(batch_size, drop_remainder=True)
+                .with_options(options)
+                .prefetch(tf.data.AUTOTUNE))
+
+    dataset = strategy.distribute_datasets_from_function(dataset_fn)
+    steps = max(1, len(x) // batch_size)
+
+    with strategy.scope():
+        model = build_lstm(x.shape[1])
+
+    epoch_times = []
+
+    class EpochTimer(Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_times.append(time.perf_counter() - self.start)
+
+    history = model.fit(dataset, epochs=epochs, steps_per_epoch=steps, verbose=0, callbacks=[EpochTimer()])
+
+    # All workers must save; only the chief's copy is kept
+    if save_path:
+        if index == 0:
+            model.save(save_path)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                model.save(os.path.join(directory, 'model.keras'))
+    if index == 0:
+        results.put((epoch_times, steps * batch_size * n_workers, float(history.history['loss'][-1])))
+
+
+def train(tickers, artifacts, workers=2, epochs=EPOCHS, batch_size=32, pin=True, save_path=None):
+    """
+    Train on the given tickers' windows with `workers` local processes.
+    With pin each worker gets its own slice of the cpus. Returns the
+    samples/second of the timed epochs and the final loss.
+    """
+    cpus = available_cpus()
+    slices = [list(part) for part in np.array_split(cpus, workers)] if pin and len(cpus) >= workers else [None] * workers
+
+    ports = _free_ports(workers)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(index, ports, tickers, artifacts, epochs, batch_size,
+                                                       slices[index], save_path, results))
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+
+    result = None
+    try:
+        while True:
+            # Checked before reading, so a chief that exited has flushed its result
+            alive = [process for process in processes if process.is_alive()]
+            # Read the chief's result before joining, its queue feeder keeps
+            # the process alive until the data is taken
+            if result is None:
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    pass
+            failed = [index for index, process in enumerate(processes) if process.exitcode not in (None, 0)]
+            if failed:
+                # The other workers would wait forever in the next all-reduce
+                raise RuntimeError(f"Training workers {failed} failed")
+            if not alive:
+                break
+            if result is not None:
+                alive[0].join(timeout=1)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    if result is None:
+        raise RuntimeError("Chief worker finished without reporting results")
+    epoch_times, samples, loss = result
+    # The first epoch includes graph tracing and cluster setup
+    timed = epoch_times[1:] or epoch_times
+    return samples * len(timed) / sum(timed), loss
+
+
+def scaling_report(tickers, artifacts, worker_counts, epochs, batch_size, pin=True):
+    """
+    Throughput for each worker count against a single worker.
+    Efficiency = throughput(N) / (N * throughput(1)).
+    """
+    print(f"{'workers':>8}{'samples/s':>12}{'speedup':>10}{'efficiency':>12}{'loss':>10}")
+    baseline = None
+    rows = []
+    for workers in sorted(set([1] + list(worker_counts))):
+        rate, loss = train(tickers, artifacts, workers, epochs, batch_size, pin)
+        baseline = baseline or rate
+        speedup = rate / baseline
+        rows.append({'workers': workers, 'samples_per_s': rate, 'speedup': speedup,
+                     'efficiency': speedup / workers, 'loss': loss})
+        print(f"{workers:>8}{rate:>12.1f}{speedup:>10.2f}{speedup / workers:>12.2f}{loss:>10.5f}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-parallel LSTM training across local worker processes")
+    parser.add_argument('tickers', nargs='+', help="tickers whose training windows are used")
+    parser.add_argument('--artifacts', default='artifacts')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--batch-size', type=int, default=32, help="batch size per worker")
+    parser.add_argument('--no-pin', action='store_true', help="do not give each worker its own cpus")
+    parser.add_argument('--save', help="where the chief worker saves the trained model")
+    parser.add_argument('--scaling', action='store_true',
+                        help="compare 1, 2, 4, ... up to --workers workers instead of training once")
+    args = parser.parse_args()
+
+    if args.scaling:
+        counts = [2 ** i for i in range(int(np.log2(args.workers)) + 1)] + [args.workers]
+        scaling_report(args.tickers, args.artifacts, counts, args.epochs, args.batch_size, not args.no_pin)
+    else:
+        rate, loss = train(args.tickers, args.artifacts, args.workers, args.epochs, args.batch_size,
+                           not args.no_pin, args.save)
+        print(f"Workers: {args.workers}, samples/s: {rate:.1f}, final loss: {loss:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import TradingCalendar
+
+# Per-ticker stages of the prediction pipeline. Every stage reads the
+# artifacts written by the previous one from artifacts/<ticker>/ and writes
+# its own, so the stages can run in different processes (see scheduler.py).
+STAGES = ('fetch', 'features', 'train', 'predict', 'evaluate')
+
+WINDOW = 60
+TRAIN_SIZE = 3000
+EPOCHS = 100
+START_DATE = "2022-01-01"
+MODEL_VERSION = "stacked-lstm-4x50"
+
+_runtime_configured = False
+
+
+def ticker_dir(artifacts, ticker):
+    path = os.path.join(artifacts, ticker.lower())
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def artifact_path(artifacts, ticker, name, interval=None):
+    """
+    Path of a per-ticker artifact. Artifacts built from resampled bars carry
+    the interval in their name (windows_5m.npz, model_5m.keras), so the
+    stages can run at several intervals side by side.
+    """
+    if interval is not None:
+        root, ext = os.path.splitext(name)
+        name = f"{root}_{interval}{ext}"
+    return os.path.join(ticker_dir(artifacts, ticker), name)
+
+
+def _atomic_save(path, save):
+    """Write through a temp file so a killed worker never leaves half an artifact."""
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.tmp{ext}"
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def ensure_runtime():
+    # Apply runtime_config once per worker process before keras is imported
+    global _runtime_configured
+    if not _runtime_configured:
+        from runtime_config import configure_runtime
+        configure_runtime()
+        _runtime_configured = True
+
+
+def build_lstm(window=WINDOW):
+    """Stacked LSTM used by Stock Prediction.py."""
+    ensure_runtime()
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dropout, Dense
+
+    model = Sequential()
+    model.add(LSTM(units=50, return_sequences=True, input_shape=(window, 1)))
+    model.add(Dropout(0.2))
+    model.add(LSTM(units=50, return_sequences=True))
+    model.add(Dropout(0.2))
+    model.add(LSTM(units=50, return_sequences=True))
+    model.add(Dropout(0.2))
+    model.add(LSTM(units=50))
+    model.add(Dropout(0.2))
+    model.add(Dense(units=1))
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+
+def make_windows(series, window=WINDOW):
+    """Sliding windows of length `window` over a 1-d array and the value after each."""
+    series = np.asarray(series, dtype=np.float32)
+    x = np.lib.stride_tricks.sliding_window_view(series[:-1], window)
+    y = series[window:]
+    return x.reshape(x.shape[0], window, 1), y
+
+
+def load_prices(artifacts, ticker, interval=None):
+    """Hourly Yahoo bars, or bars resampled from the minute store by resample.py."""
+    return pd.read_pickle(artifact_path(artifacts, ticker, 'prices.pkl', interval))
+
+
+def load_windows(artifacts, ticker, interval=None):
+    with np.load(artifact_path(artifacts, ticker, 'windows.npz', interval)) as data:
+        return {key: data[key] for key in data.files}
+
+
+def fetch(ticker, artifacts, interval=None, start=START_DATE):
+    """
+    Download hourly prices from Yahoo Finance. For another interval the
+    minute store is extended instead and resampled to that interval.
+    """
+    if interval is not None:
+        from resample import resample_store
+
+        fetch_minutes(ticker, artifacts)
+        resample_store(artifacts, ticker, [interval])
+        return
+
+    import yfinance as yf
+
+    prices = yf.Ticker(ticker).history(start=start, period='max', interval="1h")
+    if prices.empty:
+        raise ValueError(f"No price data returned for {ticker}")
+    path = artifact_path(artifacts, ticker, 'prices.pkl')
+    _atomic_save(path, lambda tmp: prices.to_pickle(tmp, compression=None))
+
+
+def fetch_minutes(ticker, artifacts, period='7d'):
+    """
+    Append the latest 1-minute bars to the raw minute store minutes.pkl.
+    Yahoo only serves a few days of minute data per request, so the store
+    grows by calling this regularly.
+    """
+    import yfinance as yf
+
+    minutes = yf.Ticker(ticker).history(period=period, interval="1m")
+    path = os.path.join(ticker_dir(artifacts, ticker), 'minutes.pkl')
+    if os.path.exists(path):
+        stored = pd.read_pickle(path)
+        minutes = pd.concat([stored, minutes[minutes.index > stored.index[-1]]])
+    _atomic_save(path, lambda tmp: minutes.to_pickle(tmp, compression=None))
+
+
+def features(ticker, artifacts, window=WINDOW, train_size=TRAIN_SIZE, cross_sessions=True, interval=None):
+    """Scale the close price on the training part and cut train/test windows."""
+    prices = load_prices(artifacts, ticker, interval)
+    close = prices['Close'].to_numpy(dtype=np.float64)
+    if len(close) <= train_size + window:
+        raise ValueError(f"Not enough history for {ticker}: {len(close)} bars")
+
+    # Min-max scaling fitted on the training part only
+    data_min, data_max = close[:train_size].min(), close[:train_size].max()
+    scale = 1.0 / (data_max - data_min) if data_max > data_min else 1.0
+    scaled = (close - data_min) * scale
+
+    # Drop windows that run over missing bars; nights, weekends and holidays
+    # are not gaps because the calendar has no bars there
+    calendar = TradingCalendar.from_index(prices.index)
+    bar_ids = calendar.bar_ids(prices.index)
+
+    x_train, y_train = make_windows(scaled[:train_size], window)
+    train_mask = calendar.window_mask(bar_ids[:train_size], window, cross_sessions)
+    x_train, y_train = x_train[train_mask], y_train[train_mask]
+
+    x_test, y_test = make_windows(scaled[train_size - window:], window)
+    test_mask = calendar.window_mask(bar_ids[train_size - window:], window, cross_sessions)
+    x_test, y_test = x_test[test_mask], y_test[test_mask]
+    test_index = prices.index[train_size:][test_mask].as_unit('ns').asi8
+
+    path = artifact_path(artifacts, ticker, 'windows.npz', interval)
+    _atomic_save(path, lambda tmp: np.savez(tmp, x_train=x_train, y_train=y_train,
+                                            x_test=x_test, y_test=y_test, test_index=test_index,
+                                            data_min=data_min, scale=scale))
+
+
+def train(ticker, artifacts, epochs=EPOCHS, interval=None):
+    from runtime_config import resolve_batch_size
+
+    windows = load_windows(artifacts, ticker, interval)
+    model = build_lstm(windows['x_train'].shape[1])
+    batch_size = resolve_batch_size(model, windows['x_train'], windows['y_train'])
+    model.fit(windows['x_train'], windows['y_train'], epochs=epochs, batch_size=batch_size, verbose=0)
+    path = artifact_path(artifacts, ticker, 'model.keras', interval)
+    _atomic_save(path, model.save)
+
+
+def load_model(artifacts, ticker, interval=None):
+    ensure_runtime()
+    from keras.models import load_model as keras_load_model
+    return keras_load_model(artifact_path(artifacts, ticker, 'model.keras', interval))
+
+
+def predict(ticker, artifacts, interval=None):
+    """Predict the test part and store the prices next to their timestamps."""
+    from runtime_config import resolve_batch_size
+
+    windows = load_windows(artifacts, ticker, interval)
+    model = load_model(artifacts, ticker, interval)
+    x_test = windows['x_test']
+    scaled = model.predict(x_test, batch_size=resolve_batch_size(model, x_test), verbose=0).ravel()
+
+    prices = load_prices(artifacts, ticker, interval)
+    index = pd.DatetimeIndex(windows['test_index']).tz_localize('UTC').tz_convert(prices.index.tz)
+    predicted = pd.DataFrame({
+        'Predicted Close': scaled / windows['scale'] + windows['data_min'],
+        'Close': windows['y_test'] / windows['scale'] + windows['data_min'],
+    }, index=index)
+    path = artifact_path(artifacts, ticker, 'predictions.pkl', interval)
+    _atomic_save(path, lambda tmp: predicted.to_pickle(tmp, compression=None))
+
+
+def evaluate(ticker, artifacts, interval=None):
+    """Overall MSE and MSE per hour of the day on the test part."""
+    path = artifact_path(artifacts, ticker, 'predictions.pkl', interval)
+    predicted = pd.read_pickle(path)
+    squared_error = (predicted['Predicted Close'] - predicted['Close']) ** 2
+    hourly = squared_error.groupby(predicted.index.hour).mean()
+    metrics = {
+        'ticker': ticker,
+        'mse': float(squared_error.mean()),
+        'hourly_mse': {int(hour): float(mse) for hour, mse in hourly.items()},
+    }
+    path = artifact_path(artifacts, ticker, 'metrics.json', interval)
+    _atomic_save(path, lambda tmp: _write_json(tmp, metrics))
+
+    # Keep the predictions and metrics of every run queryable, see results_store.py
+    from results_store import ResultsStore, new_run_id
+
+    run_id = os.getenv('STOCK_RUN_ID') or new_run_id()
+    # Models of different intervals are different models to compare
+    version = MODEL_VERSION if interval is None else f"{MODEL_VERSION}-{interval}"
+    with ResultsStore(os.path.join(artifacts, 'results.db')) as store:
+        store.start_run(version, run_id=run_id)
+        store.add_predictions(run_id, ticker, version, predicted.index,
+                              predicted['Predicted Close'].to_numpy(), predicted['Close'].to_numpy())
+        store.add_metric(run_id, ticker, version, 'mse', metrics['mse'])
+
+
+STAGE_FUNCTIONS = {
+    'fetch': fetch,
+    'features': features,
+    'train': train,
+    'predict': predict,
+    'evaluate': evaluate,
+}
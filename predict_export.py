@@ -0,0 +1,181 @@
+import os
+import argparse
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import TradingCalendar
+from pipeline import WINDOW, artifact_path, load_prices, load_model
+from runtime_config import resolve_batch_size
+
+
+class PartitionedWriter:
+    """
+    Writes each (date, ticker) block of predictions to its own file as soon
+    as it is produced, as <out>/date=YYYY-MM-DD/ticker=<ticker>.<fmt>, so
+    nothing is kept in memory between tickers.
+    """
+
+    def __init__(self, out_dir, fmt='csv'):
+        if fmt not in ('csv', 'parquet'):
+            raise ValueError(f"Unsupported format: {fmt}")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.rows = 0
+
+    def write(self, date, ticker, frame):
+        directory = os.path.join(self.out_dir, f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"ticker={ticker}.{self.fmt}")
+        if self.fmt == 'csv':
+            frame.to_csv(path, index=False)
+        else:
+            frame.to_parquet(path, index=False)
+        self.rows += len(frame)
+
+
+def _session_of_date(calendar, date):
+    """Session id of a date, -1 if the calendar has no session on it."""
+    date_ns = pd.Timestamp(date).as_unit('ns').value
+    session = np.searchsorted(calendar.session_ns, date_ns)
+    if session < calendar.n_sessions and calendar.session_ns[session] == date_ns:
+        return session
+    return -1
+
+
+def predict_ticker(ticker, dates, artifacts, window=WINDOW, quantized=None):
+    """
+    Hourly predictions of one ticker for each date, yielded as (date, frame)
+    pairs one partition at a time. Dates covered by the price history get
+    one-step-ahead predictions from the actual previous bars, all in a
+    single batched predict call; bars whose window runs over a missing bar
+    are skipped, as pipeline.features drops those windows from training.
+    Dates after the history are forecast recursively through every weekday
+    from the end of the history (holidays are not known there), with the
+    regular bar times of a full session. With `quantized` the TFLite model
+    of that mode from quantize.py is used.
+    """
+    prices = load_prices(artifacts, ticker)
+    with np.load(artifact_path(artifacts, ticker, 'windows.npz')) as data:
+        data_min, scale = float(data['data_min']), float(data['scale'])
+    if quantized:
+        from quantize import load_quantized
+        model = load_quantized(artifacts, ticker, quantized)
+    else:
+        model = load_model(artifacts, ticker)
+
+    calendar = TradingCalendar.from_index(prices.index)
+    bar_ids = calendar.bar_ids(prices.index)
+    close = calendar.to_dense(bar_ids, prices['Close'].to_numpy())
+    scaled = (close - data_min) * scale
+    # Bars with a complete window of actual bars before them
+    complete = np.zeros(len(close), dtype=bool)
+    complete[bar_ids[window:][calendar.window_mask(bar_ids, window)]] = True
+
+    known, future = [], []
+    for date in sorted(dates):
+        session = _session_of_date(calendar, date)
+        if session >= 0:
+            known.append((date, session))
+        elif pd.Timestamp(date).dayofweek < 5 and pd.Timestamp(date).as_unit('ns').value > calendar.session_ns[-1]:
+            future.append(date)
+        else:
+            print(f"No trading session for {ticker} on {date}, skipped")
+
+    targets = np.concatenate([calendar.session_bars(s) for _, s in known] + [np.empty(0, dtype=np.int64)])
+    # Bars at the start of the history just lack a full window, reported per date below
+    gaps = np.count_nonzero(~complete[targets] & ~np.isnan(close[targets]) & (targets >= window))
+    if gaps:
+        print(f"{gaps} bars of {ticker} follow a missing bar within their window, skipped")
+    targets = targets[complete[targets]]
+    if len(targets):
+        x = np.stack([scaled[b - window:b] for b in targets])[..., np.newaxis].astype(np.float32)
+        predicted = model.predict(x, batch_size=resolve_batch_size(model, x), verbose=0).ravel()
+        predicted = predicted / scale + data_min
+        timestamps = calendar.timestamps(targets)
+    for date, session in known:
+        in_session = calendar.session_of_bar[targets] == session
+        if not in_session.any():
+            print(f"Not enough history before {date} for {ticker}, skipped")
+            continue
+        yield date, pd.DataFrame({
+            'ticker': ticker,
+            'timestamp': timestamps[in_session],
+            'predicted_close': predicted[in_session],
+            'close': close[targets[in_session]],
+        })
+
+    if future:
+        # Bar times of day of the longest session, i.e. a full trading day
+        longest = int(np.argmax(calendar.session_end - calendar.session_start))
+        bar_times = calendar.bar_ns[calendar.session_bars(longest)] - calendar.session_ns[longest]
+
+        # Roll the forecast through every weekday after the history so each
+        # requested date gets the bars of its own session, not the next one
+        requested = set(future)
+        observed = prices['Close'].to_numpy(dtype=np.float64)[-window:]
+        history = deque((observed - data_min) * scale, maxlen=window)
+        first_day = pd.Timestamp(calendar.session_ns[-1]) + pd.Timedelta(days=1)
+        for day in pd.bdate_range(first_day, max(future)):
+            forecast = []
+            for _ in bar_times:
+                x = np.asarray(history, dtype=np.float32).reshape(1, window, 1)
+                value = float(np.asarray(model(x, training=False))[0, 0])
+                history.append(value)
+                forecast.append(value)
+            date = day.strftime('%Y-%m-%d')
+            if date not in requested:
+                continue
+            timestamps = pd.DatetimeIndex(day.as_unit('ns').value + bar_times).tz_localize(calendar.tz)
+            yield date, pd.DataFrame({
+                'ticker': ticker,
+                'timestamp': timestamps,
+                'predicted_close': np.asarray(forecast) / scale + data_min,
+                'close': np.nan,
+            })
+
+
+def export(tickers, dates, artifacts, out_dir, fmt='csv', quantized=None):
+    """Predict every ticker for every date and stream the results to partitioned files."""
+    writer = PartitionedWriter(out_dir, fmt)
+    failed = []
+    for ticker in tickers:
+        try:
+            for date, frame in predict_ticker(ticker, dates, artifacts, quantized=quantized):
+                writer.write(date, ticker, frame)
+        except Exception as e:
+            print(f"Error exporting {ticker}: {str(e)}")
+            failed.append(ticker)
+    print(f"Wrote {writer.rows} predictions for {len(tickers) - len(failed)} tickers to {out_dir}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='predict-export',
+                                     description="Export hourly predictions of the trained models")
+    parser.add_argument('--tickers', nargs='*', default=[], help="tickers to export")
+    parser.add_argument('--universe', help="file with one ticker per line, see scheduler.py")
+    parser.add_argument('--dates', nargs='+', required=True, help="dates as YYYY-MM-DD")
+    parser.add_argument('--artifacts', default='artifacts', help="directory with the trained models")
+    parser.add_argument('--out', default='predictions', help="output directory")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--quantized', choices=('dynamic', 'float16', 'int8'),
+                        help="use the quantized model of this mode, see quantize.py")
+    args = parser.parse_args()
+
+    tickers = list(args.tickers)
+    if args.universe:
+        from scheduler import read_universe
+        tickers += read_universe(args.universe)
+    if not tickers:
+        parser.error("No tickers given, use --tickers or --universe")
+
+    dates = [pd.Timestamp(date).strftime('%Y-%m-%d') for date in args.dates]
+    failed = export(tickers, dates, args.artifacts, args.out, args.format, args.quantized)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import time
+import argparse
+
+import numpy as np
+
+from pipeline import artifact_path, load_model, load_windows, ensure_runtime
+
+# dynamic: int8 weights, float activations (no calibration data needed)
+# float16: float16 weights, half the size of float32
+# int8:    int8 weights and activations, calibrated on the training windows
+# float32 is also accepted by convert(): the unquantized baseline of the report
+MODES = ('dynamic', 'float16', 'int8')
+
+
+def quantized_path(artifacts, ticker, mode, interval=None):
+    return artifact_path(artifacts, ticker, f"model_{mode}.tflite", interval)
+
+
+def convert(model, mode, calibration=None, window=None):
+    """
+    Convert a keras model to a TFLite flatbuffer with post-training
+    quantization, or without any for mode 'float32'.
+    """
+    ensure_runtime()
+    import tensorflow as tf
+
+    window = window or model.input_shape[1]
+    # Fixed window with a free batch dimension, resized by the predictor
+    run = tf.function(lambda x: model(x, training=False))
+    concrete = run.get_concrete_function(tf.TensorSpec([None, window, 1], tf.float32))
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete], model)
+    if mode == 'float32':
+        return converter.convert()
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if calibration is None:
+            raise ValueError("int8 quantization needs calibration windows")
+
+        def representative_dataset():
+            for i in range(min(len(calibration), 200)):
+                yield [calibration[i:i + 1].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+    elif mode != 'dynamic':
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    return converter.convert()
+
+
+class TFLitePredictor:
+    """
+    Runs a quantized model with the TFLite CPU interpreter. Exposes the same
+    predict/predict_on_batch/__call__ calls as the keras model, so it can
+    replace it in predict_export.py and runtime_config.autotune_batch_size.
+    """
+
+    def __init__(self, path, num_threads=None):
+        ensure_runtime()
+        import tensorflow as tf
+
+        if num_threads is None:
+            from runtime_config import get_runtime_settings
+            num_threads = get_runtime_settings()['intra_op_threads']
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_shape = None
+
+    def predict_on_batch(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if x.shape != self.batch_shape:
+            # Re-allocating is only needed when the batch size changes
+            self.interpreter.resize_tensor_input(self.input['index'], x.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_shape = x.shape
+        self.interpreter.set_tensor(self.input['index'], x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index'])
+
+    def predict(self, x, batch_size=256, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        batch_size = min(batch_size or len(x), len(x))
+        outputs = []
+        for i in range(0, len(x), batch_size):
+            batch = x[i:i + batch_size]
+            if len(batch) < batch_size:
+                # Pad the last batch so the interpreter keeps its allocated shape
+                padding = np.zeros((batch_size - len(batch),) + batch.shape[1:], dtype=np.float32)
+                outputs.append(self.predict_on_batch(np.concatenate([batch, padding]))[:len(batch)])
+            else:
+                outputs.append(self.predict_on_batch(batch))
+        return np.concatenate(outputs)
+
+    def __call__(self, x, training=False):
+        return self.predict_on_batch(x)
+
+
+def load_quantized(artifacts, ticker, mode, interval=None):
+    return TFLitePredictor(quantized_path(artifacts, ticker, mode, interval))
+
+
+def _timed_predict(predictor, x, batch_size, repeats=3):
+    predictor.predict(x[:batch_size], batch_size=batch_size, verbose=0)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predicted = predictor.predict(x, batch_size=batch_size, verbose=0)
+    per_batch = (time.perf_counter() - start) / repeats / int(np.ceil(len(x) / batch_size))
+    return np.asarray(predicted).ravel(), per_batch
+
+
+def quantize_ticker(ticker, artifacts, modes=MODES, batch_size=256, interval=None):
+    """
+    Quantize a ticker's registered model in each mode and compare it with a
+    plain float32 TFLite conversion on the held-out windows, so sizes and
+    timings are of the same runtime and exclude the optimizer state saved in
+    model.keras. Returns one report row per model.
+    """
+    windows = load_windows(artifacts, ticker, interval)
+    x_test, y_test = windows['x_test'], windows['y_test']
+    model = load_model(artifacts, ticker, interval)
+    scale = windows['scale']
+
+    rows = []
+    reference = reference_mse = None
+    for mode in ('float32',) + tuple(mode for mode in modes if mode != 'float32'):
+        path = quantized_path(artifacts, ticker, mode, interval)
+        with open(path, 'wb') as f:
+            f.write(convert(model, mode, windows['x_train']))
+        predicted, per_batch = _timed_predict(TFLitePredictor(path), x_test, batch_size)
+        mse = float(np.mean(((predicted - y_test) / scale) ** 2))
+        if reference is None:
+            reference, reference_mse = predicted, mse
+        rows.append({'ticker': ticker, 'mode': mode, 'size_kb': os.path.getsize(path) / 1024,
+                     'mse': mse, 'mse_delta': mse - reference_mse,
+                     'max_abs_diff': float(np.max(np.abs(predicted - reference)) / scale),
+                     'ms_per_batch': per_batch * 1e3})
+    return rows
+
+
+def print_report(rows):
+    print(f"{'ticker':<8}{'mode':<9}{'size KB':>10}{'MSE':>12}{'MSE delta':>12}"
+          f"{'max |diff|':>12}{'ms/batch':>10}")
+    for r in rows:
+        print(f"{r['ticker']:<8}{r['mode']:<9}{r['size_kb']:>10.1f}{r['mse']:>12.4f}{r['mse_delta']:>12.4f}"
+              f"{r['max_abs_diff']:>12.4f}{r['ms_per_batch']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize trained models for CPU inference")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--artifacts', default='artifacts')
+    parser.add_argument('--modes', default=','.join(MODES), help="comma separated quantization modes")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--interval', default=None, help="quantize the model trained on prices_<interval>.pkl")
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(',') if mode]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}")
+
+    rows = []
+    for ticker in args.tickers:
+        rows += quantize_ticker(ticker, args.artifacts, modes, args.batch_size, args.interval)
+    print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
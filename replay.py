@@ -0,0 +1,241 @@
+import json
+import time
+import queue
+import socket
+import argparse
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+from pipeline import WINDOW, artifact_path, load_prices
+
+# Bars are sent as (ticker, bar time ns, close, send time ns); None ends the feed.
+# Latency is measured with time.monotonic_ns, which all processes on a host share.
+
+
+def load_feed(artifacts, tickers, interval=None):
+    """Cached bars of all tickers merged in timestamp order as (times, ticker ids, closes)."""
+    times, ids, closes = [], [], []
+    for ticker_id, ticker in enumerate(tickers):
+        prices = load_prices(artifacts, ticker, interval)
+        times.append(prices.index.as_unit('ns').asi8)
+        ids.append(np.full(len(prices), ticker_id))
+        closes.append(prices['Close'].to_numpy(dtype=np.float64))
+    times, ids, closes = np.concatenate(times), np.concatenate(ids), np.concatenate(closes)
+    order = np.argsort(times, kind='stable')
+    return times[order], ids[order], closes[order]
+
+
+def _check_consumer(consumer):
+    if not consumer.is_alive():
+        raise RuntimeError(f"Predictor process exited with code {consumer.exitcode}")
+
+
+def _get_result(results, consumer, poll=1.0):
+    """Next message of the predictor, raises instead of waiting forever once it has died."""
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            if not consumer.is_alive():
+                # It may have put its last message right before exiting
+                try:
+                    return results.get(timeout=poll)
+                except queue.Empty:
+                    _check_consumer(consumer)
+
+
+class QueueTransport:
+    """Local multiprocessing queue between the replay and the predictor process."""
+
+    def __init__(self, context):
+        self.queue = context.Queue(maxsize=10000)
+
+    def sender(self, consumer):
+        def send(message):
+            # A full queue means the predictor is behind or dead, only the first is worth waiting for
+            while True:
+                try:
+                    return self.queue.put(message, timeout=1)
+                except queue.Full:
+                    _check_consumer(consumer)
+        return send
+
+    def receiver(self):
+        return iter(self.queue.get, None)
+
+    def close(self, send):
+        send(None)
+
+    def abort(self):
+        # Bars nobody will read must not keep this process from exiting
+        self.queue.cancel_join_thread()
+
+
+class SocketTransport:
+    """Newline separated JSON over a localhost TCP socket, as a network feed would arrive."""
+
+    def __init__(self, context, port=0):
+        self.server = socket.create_server(('127.0.0.1', port))
+        self.port = self.server.getsockname()[1]
+
+    def __getstate__(self):
+        # The listening socket stays in the parent, the predictor only needs the port
+        return {'port': self.port}
+
+    def sender(self, consumer):
+        # Wait for the predictor to connect, unless it exits first
+        self.server.settimeout(1)
+        while True:
+            try:
+                conn, _ = self.server.accept()
+                break
+            except socket.timeout:
+                _check_consumer(consumer)
+        conn.settimeout(None)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = conn.makefile('w')
+
+        def send(message):
+            self.stream.write(json.dumps(message) + '\n')
+            self.stream.flush()
+        return send
+
+    def receiver(self):
+        conn = socket.create_connection(('127.0.0.1', self.port))
+        for line in conn.makefile('r'):
+            message = json.loads(line)
+            if message is None:
+                return
+            yield message
+
+    def close(self, send):
+        send(None)
+        self.stream.close()
+        self.server.close()
+
+    def abort(self):
+        self.server.close()
+
+
+def replay(feed, tickers, send, speedup=1.0, max_gap=None):
+    """
+    Publish the bars in timestamp order. speedup=100 plays 100 market seconds
+    per second, speedup=0 sends as fast as possible. max_gap caps the market
+    time between two bars (seconds) so nights and weekends do not stall a 1x run.
+    """
+    times, ids, closes = feed
+    if speedup and max_gap is not None:
+        gaps = np.minimum(np.diff(times, prepend=times[0]), int(max_gap * 1e9))
+        times = times[0] + np.cumsum(gaps)
+    start = time.monotonic_ns()
+    for i in range(len(times)):
+        if speedup:
+            due = start + (times[i] - times[0]) / speedup
+            delay = (due - time.monotonic_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+        send((tickers[ids[i]], int(times[i]), float(closes[i]), time.monotonic_ns()))
+    return start
+
+
+def make_predictor(artifacts, ticker, model='lstm', interval=None):
+    """
+    Function from the last WINDOW closes to the predicted next close.
+    model is 'lstm', a quantize.py mode or 'naive' (no model, to measure
+    the transport on its own), trained on bars of `interval`.
+    """
+    if model == 'naive':
+        return lambda window: window[-1]
+
+    with np.load(artifact_path(artifacts, ticker, 'windows.npz', interval)) as data:
+        data_min, scale = float(data['data_min']), float(data['scale'])
+    if model == 'lstm':
+        from pipeline import load_model
+        net = load_model(artifacts, ticker, interval)
+    else:
+        from quantize import load_quantized
+        net = load_quantized(artifacts, ticker, model, interval)
+
+    def predict(window):
+        x = ((np.asarray(window, dtype=np.float32) - data_min) * scale).reshape(1, -1, 1)
+        return float(np.asarray(net(x, training=False))[0, 0]) / scale + data_min
+    return predict
+
+
+def run_predictor(transport, artifacts, tickers, model, results, interval=None, window=WINDOW):
+    """Consume the feed bar by bar, predict once a ticker has a full window, record latencies."""
+    predictors = {ticker: make_predictor(artifacts, ticker, model, interval) for ticker in tickers}
+    history = {ticker: deque(maxlen=window) for ticker in tickers}
+    latencies = []
+    bars = 0
+    results.put('ready')
+    for ticker, _, close, sent_ns in transport.receiver():
+        bars += 1
+        history[ticker].append(close)
+        if len(history[ticker]) == window:
+            predictors[ticker](history[ticker])
+            latencies.append(time.monotonic_ns() - sent_ns)
+    results.put((bars, np.asarray(latencies, dtype=np.int64), time.monotonic_ns()))
+
+
+def latency_report(latencies_ns, bars, elapsed):
+    """Percentiles and a log2 histogram of the end-to-end latency in microseconds."""
+    print(f"Bars: {bars}, predictions: {len(latencies_ns)}, elapsed: {elapsed:.2f}s, "
+          f"throughput: {bars / elapsed:.1f} bars/s")
+    if not len(latencies_ns):
+        return
+    us = latencies_ns / 1e3
+    p50, p90, p99 = np.percentile(us, [50, 90, 99])
+    print(f"Latency us: p50 {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}, max {us.max():.0f}")
+    edges = 2.0 ** np.arange(np.floor(np.log2(max(us.min(), 1))), np.ceil(np.log2(us.max())) + 2)
+    counts, _ = np.histogram(us, bins=edges)
+    for low, high, count in zip(edges[:-1], edges[1:], counts):
+        bar = '#' * int(50 * count / counts.max()) if counts.max() else ''
+        print(f"{low:>10.0f}-{high:<10.0f}us {count:>8} {bar}")
+
+
+def run(artifacts, tickers, speedup=0, transport='queue', model='lstm', interval=None, max_gap=None):
+    feed = load_feed(artifacts, tickers, interval)
+    context = multiprocessing.get_context('spawn')
+    channel = QueueTransport(context) if transport == 'queue' else SocketTransport(context)
+    results = context.Queue()
+    consumer = context.Process(target=run_predictor, args=(channel, artifacts, tickers, model, results, interval))
+    consumer.start()
+    try:
+        # Start the clock only once the models are loaded
+        _get_result(results, consumer)
+
+        send = channel.sender(consumer)
+        start = replay(feed, tickers, send, speedup, max_gap)
+        channel.close(send)
+        bars, latencies, finished = _get_result(results, consumer)
+    except BaseException:
+        # A predictor stuck on a full queue or an open socket would outlive the replay
+        if consumer.is_alive():
+            consumer.terminate()
+        channel.abort()
+        raise
+    finally:
+        consumer.join()
+    # Throughput up to the last prediction, including any backlog the predictor had to drain
+    latency_report(latencies, bars, (finished - start) / 1e9)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay cached bars as a live feed and measure prediction latency")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--artifacts', default='artifacts')
+    parser.add_argument('--speedup', type=float, default=0, help="market seconds per second, 0 = as fast as possible")
+    parser.add_argument('--max-gap', type=float, default=None, help="cap on market seconds between bars")
+    parser.add_argument('--transport', choices=('queue', 'socket'), default='queue')
+    parser.add_argument('--model', choices=('lstm', 'dynamic', 'float16', 'int8', 'naive'), default='lstm')
+    parser.add_argument('--interval', default=None, help="replay prices_<interval>.pkl with the model trained on it")
+    args = parser.parse_args()
+    run(args.artifacts, args.tickers, args.speedup, args.transport, args.model, args.interval, args.max_gap)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import re
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import EXCHANGE_TZ, _local_ns
+
+DAY_NS = 24 * 3600 * 10**9
+UNIT_NS = {'s': 10**9, 'm': 60 * 10**9, 'h': 3600 * 10**9}
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def _time_ns(value):
+    """'09:30' as nanoseconds after midnight."""
+    hours, minutes = value.split(':')
+    return (int(hours) * 60 + int(minutes)) * UNIT_NS['m']
+
+
+def interval_ns(interval):
+    """Length of an interval such as '5m', '15m' or '1h' in ns, None for 'session'."""
+    if interval == 'session':
+        return None
+    match = re.fullmatch(r'(\d+)([smh])', interval)
+    if not match:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return int(match.group(1)) * UNIT_NS[match.group(2)]
+
+
+def bar_labels(local_ns, interval, session_open='09:30'):
+    """
+    Start time of the bar each row falls into, in exchange wall-clock ns.
+    Intraday bars are anchored at the session open (09:30, 10:30, ... for
+    '1h', like the Yahoo bars); 'session' puts a whole day in one bar.
+    """
+    day = local_ns - local_ns % DAY_NS
+    open_ns = _time_ns(session_open)
+    length = interval_ns(interval)
+    if length is None:
+        return day + open_ns
+    return day + open_ns + (local_ns - day - open_ns) // length * length
+
+
+def aggregate(labels, open, high, low, close, volume):
+    """
+    OHLCV of each run of equal labels. The input is sorted by time, so every
+    bar is a contiguous slice and ufunc.reduceat over the slice starts
+    aggregates all bars in one pass.
+    """
+    if len(labels) == 0:
+        return labels, open, high, low, close, volume
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)] - 1
+    return (labels[starts], open[starts], np.maximum.reduceat(high, starts),
+            np.minimum.reduceat(low, starts), close[ends], np.add.reduceat(volume, starts))
+
+
+class BarResampler:
+    """
+    Resamples 1-minute bars or ticks into OHLCV bars of any interval and
+    updates incrementally: each update returns the bars completed so far and
+    keeps the last, still open bar until later data or flush() closes it.
+    """
+
+    def __init__(self, interval='1h', tz=EXCHANGE_TZ, session_open='09:30', session_close='16:00',
+                 regular_hours=True):
+        interval_ns(interval)
+        self.interval = interval
+        self.tz = tz
+        self.session_open = session_open
+        self.open_ns = _time_ns(session_open)
+        self.close_ns = _time_ns(session_close)
+        self.regular_hours = regular_hours
+        # Open bar as (label, open, high, low, close, volume)
+        self.pending = None
+
+    def _frame(self, bars):
+        labels, *values = bars
+        index = pd.DatetimeIndex(labels.astype('datetime64[ns]')).tz_localize(self.tz)
+        return pd.DataFrame(dict(zip(COLUMNS, values)), index=index)
+
+    def update(self, timestamps, open, high=None, low=None, close=None, volume=None):
+        """
+        Add new rows in time order and return the bars that are now complete.
+        For ticks pass the trade price as `open` and the size as `volume`.
+        """
+        local = _local_ns(timestamps, self.tz)
+        open = np.asarray(open, dtype=np.float64)
+        high = open if high is None else np.asarray(high, dtype=np.float64)
+        low = open if low is None else np.asarray(low, dtype=np.float64)
+        close = open if close is None else np.asarray(close, dtype=np.float64)
+        volume = np.zeros(len(local)) if volume is None else np.asarray(volume, dtype=np.float64)
+
+        if self.regular_hours:
+            time_of_day = local % DAY_NS
+            keep = (time_of_day >= self.open_ns) & (time_of_day < self.close_ns)
+            local, open, high, low, close, volume = (a[keep] for a in (local, open, high, low, close, volume))
+
+        labels = bar_labels(local, self.interval, self.session_open)
+        bars = [np.asarray(a) for a in aggregate(labels, open, high, low, close, volume)]
+        if self.pending is not None:
+            if len(bars[0]) and bars[0][0] == self.pending[0]:
+                # The open bar continues in the new data
+                label, o, h, l, _, v = self.pending
+                bars[2][0] = max(h, bars[2][0])
+                bars[3][0] = min(l, bars[3][0])
+                bars[1][0] = o
+                bars[5][0] += v
+            else:
+                bars = [np.r_[p, b] for p, b in zip(self.pending, bars)]
+        if not len(bars[0]):
+            return self._frame(bars)
+
+        self.pending = tuple(b[-1] for b in bars)
+        return self._frame([b[:-1] for b in bars])
+
+    def flush(self):
+        """Close the open bar, e.g. at the end of the session or of the data."""
+        if self.pending is None:
+            return self._frame([np.empty(0, dtype=np.int64)] + [np.empty(0)] * 5)
+        bars = [np.asarray([value]) for value in self.pending]
+        self.pending = None
+        return self._frame(bars)
+
+
+def resample(frame, interval, **kwargs):
+    """OHLCV bars at `interval` from a frame of minute bars (Open/High/Low/Close/Volume)."""
+    resampler = BarResampler(interval, **kwargs)
+    bars = resampler.update(frame.index, frame['Open'].to_numpy(), frame['High'].to_numpy(),
+                            frame['Low'].to_numpy(), frame['Close'].to_numpy(), frame['Volume'].to_numpy())
+    return pd.concat([bars, resampler.flush()])
+
+
+def resample_store(artifacts, ticker, intervals):
+    """
+    Update prices_<interval>.pkl for each interval from the raw minute store
+    artifacts/<ticker>/minutes.pkl, for pipeline.features(..., interval=...).
+    Only minutes from the last stored bar on are resampled again; that bar
+    may have been open when it was written, later bars are final.
+    """
+    from pipeline import _atomic_save, artifact_path, ticker_dir
+
+    directory = ticker_dir(artifacts, ticker)
+    minutes = pd.read_pickle(os.path.join(directory, 'minutes.pkl'))
+    for interval in intervals:
+        path = artifact_path(artifacts, ticker, 'prices.pkl', interval)
+        stored = pd.read_pickle(path) if os.path.exists(path) else None
+        if stored is not None and len(stored):
+            new = minutes.iloc[minutes.index.searchsorted(stored.index[-1]):]
+            stored = stored.iloc[:-1]
+        else:
+            new = minutes
+        bars = resample(new, interval)
+        if stored is not None:
+            bars = pd.concat([stored, bars])
+        _atomic_save(path, lambda tmp: bars.to_pickle(tmp, compression=None))
+        print(f"{ticker}: {len(new)} new minutes -> {len(bars)} {interval} bars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resample cached minute bars to other intervals")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--artifacts', default='artifacts')
+    parser.add_argument('--intervals', default='5m,15m,1h,session', help="comma separated intervals")
+    args = parser.parse_args()
+
+    intervals = [interval for interval in args.intervals.split(',') if interval]
+    for interval in intervals:
+        interval_ns(interval)
+    for ticker in args.tickers:
+        resample_store(args.artifacts, ticker, intervals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import EXCHANGE_TZ
+
+# Timestamps are stored as UTC epoch seconds, hour is the exchange hour of day
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    model_version TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    run_id TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    model_version TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    predicted REAL NOT NULL,
+    actual REAL,
+    PRIMARY KEY (run_id, ticker, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS predictions_ticker_ts ON predictions (ticker, ts, model_version, run_id);
+CREATE INDEX IF NOT EXISTS predictions_run_hour ON predictions (run_id, hour);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, ticker, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_ticker ON metrics (ticker, model_version, run_id);
+"""
+
+
+def new_run_id():
+    return time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+
+
+class ResultsStore:
+    """
+    SQLite store for predictions and metrics of every run. Writes are
+    buffered and inserted with executemany in one transaction per batch;
+    several worker processes can write to the same file (WAL journal).
+    """
+
+    def __init__(self, path, batch_size=10000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.prediction_rows = []
+        self.metric_rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_run(self, model_version, params=None, run_id=None):
+        run_id = run_id or new_run_id()
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)',
+                              (run_id, model_version, time.time(), json.dumps(params or {})))
+        return run_id
+
+    def add_predictions(self, run_id, ticker, model_version, timestamps, predicted, actual=None):
+        """Queue the predictions of one ticker; timestamps must be tz-aware."""
+        index = pd.DatetimeIndex(timestamps)
+        ts = index.as_unit('s').asi8
+        hours = index.tz_convert(EXCHANGE_TZ).hour
+        actual = np.full(len(ts), np.nan) if actual is None else np.asarray(actual, dtype=np.float64)
+        actual = [None if np.isnan(a) else float(a) for a in actual]
+        self.prediction_rows.extend(zip([run_id] * len(ts), [ticker] * len(ts), ts.tolist(),
+                                        [model_version] * len(ts), hours.tolist(),
+                                        np.asarray(predicted, dtype=np.float64).tolist(), actual))
+        if len(self.prediction_rows) >= self.batch_size:
+            self.flush()
+
+    def add_metric(self, run_id, ticker, model_version, name, value):
+        self.metric_rows.append((run_id, ticker, model_version, name, float(value)))
+        if len(self.metric_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  self.prediction_rows)
+            self.conn.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)', self.metric_rows)
+        self.prediction_rows = []
+        self.metric_rows = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def error_by_hour(self, run_id, ticker=None):
+        """MSE and MAE per exchange hour of day for a run, optionally for one ticker."""
+        where = 'run_id = ? AND actual IS NOT NULL'
+        params = [run_id]
+        if ticker:
+            where += ' AND ticker = ?'
+            params.append(ticker)
+        return self._query(f"""
+            SELECT hour, COUNT(*) AS n,
+                   AVG((predicted - actual) * (predicted - actual)) AS mse,
+                   AVG(ABS(predicted - actual)) AS mae
+            FROM predictions WHERE {where}
+            GROUP BY hour ORDER BY hour""", params)
+
+    def compare_runs(self, run_ids, ticker=None):
+        """MSE, MAE and prediction count of several runs side by side."""
+        placeholders = ','.join('?' * len(run_ids))
+        where = f'p.run_id IN ({placeholders}) AND actual IS NOT NULL'
+        params = list(run_ids)
+        if ticker:
+            where += ' AND ticker = ?'
+            params.append(ticker)
+        return self._query(f"""
+            SELECT p.run_id, r.model_version, r.created_at, COUNT(*) AS n,
+                   AVG((predicted - actual) * (predicted - actual)) AS mse,
+                   AVG(ABS(predicted - actual)) AS mae
+            FROM predictions p JOIN runs r ON r.run_id = p.run_id
+            WHERE {where}
+            GROUP BY p.run_id ORDER BY r.created_at""", params)
+
+    def latest_forecast(self, ticker=None, model_version=None):
+        """
+        Most recent prediction per ticker. The per-ticker MAX(ts) is answered
+        from the (ticker, ts, ...) index; ties go to the newest run.
+        """
+        where, params = '', []
+        if ticker:
+            where += ' AND p.ticker = ?'
+            params.append(ticker)
+        if model_version:
+            where += ' AND p.model_version = ?'
+            params.append(model_version)
+        frame = self._query(f"""
+            SELECT p.ticker, p.ts, p.model_version, p.run_id, p.predicted, p.actual
+            FROM predictions p
+            JOIN (SELECT ticker, MAX(ts) AS ts FROM predictions p WHERE 1 = 1 {where} GROUP BY ticker) latest
+              ON p.ticker = latest.ticker AND p.ts = latest.ts
+            JOIN runs r ON r.run_id = p.run_id
+            WHERE 1 = 1 {where}
+            ORDER BY p.ticker, r.created_at DESC""", params + params)
+        frame = frame.drop_duplicates('ticker')
+        frame['ts'] = pd.to_datetime(frame['ts'], unit='s', utc=True).dt.tz_convert(EXCHANGE_TZ)
+        return frame.reset_index(drop=True)
+
+    def runs(self):
+        return self._query('SELECT * FROM runs ORDER BY created_at')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the results store")
+    parser.add_argument('--db', default='artifacts/results.db')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('runs')
+    hourly = sub.add_parser('hourly')
+    hourly.add_argument('run_id')
+    hourly.add_argument('--ticker')
+    compare = sub.add_parser('compare')
+    compare.add_argument('run_ids', nargs='+')
+    compare.add_argument('--ticker')
+    latest = sub.add_parser('latest')
+    latest.add_argument('--ticker')
+    latest.add_argument('--model-version')
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.command == 'runs':
+            print(store.runs().to_string(index=False))
+        elif args.command == 'hourly':
+            print(store.error_by_hour(args.run_id, args.ticker).to_string(index=False))
+        elif args.command == 'compare':
+            print(store.compare_runs(args.run_ids, args.ticker).to_string(index=False))
+        else:
+            print(store.latest_forecast(args.ticker, args.model_version).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
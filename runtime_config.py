@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import itertools
+import subprocess
+
+import numpy as np
+
+# Environment variables used to tune a job without editing the scripts:
+#   STOCK_INTRA_OP_THREADS    threads used inside a single op (matmul, LSTM cell)
+#   STOCK_INTER_OP_THREADS    ops that may run at the same time
+#   STOCK_ONEDNN              1/0 to turn the oneDNN kernels on or off
+#   STOCK_CPU_AFFINITY        cpus this process may run on, e.g. "0-3,8"
+#   STOCK_PREDICT_BATCH_SIZE  inference batch size, or "auto" to pick the fastest one
+#   STOCK_TRAIN_BATCH_SIZE    training batch size, or "auto" to pick the fastest one.
+#                             Kept apart because the training batch size changes the
+#                             updates per epoch and with them the trained model
+DEFAULT_BATCH_SIZE = 32
+BATCH_SIZE_CANDIDATES = (16, 32, 64, 128, 256, 512)
+
+
+def parse_cpu_list(spec):
+    """Turn a cpu list such as "0-3,8" into a sorted list of cpu ids."""
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def _env_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def get_runtime_settings():
+    """Read the runtime settings from the environment, None means TF default."""
+    onednn = os.getenv('STOCK_ONEDNN')
+    affinity = os.getenv('STOCK_CPU_AFFINITY')
+    return {
+        'intra_op_threads': _env_int('STOCK_INTRA_OP_THREADS'),
+        'inter_op_threads': _env_int('STOCK_INTER_OP_THREADS'),
+        'onednn': None if onednn in (None, '') else onednn not in ('0', 'false', 'False'),
+        'cpus': parse_cpu_list(affinity) if affinity else None,
+        'train_batch_size': os.getenv('STOCK_TRAIN_BATCH_SIZE') or None,
+        'predict_batch_size': os.getenv('STOCK_PREDICT_BATCH_SIZE') or None,
+    }
+
+
+def available_cpus():
+    """Cpus this process may run on, all of them where affinity is not supported."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def set_cpu_affinity(cpus):
+    """Pin the current process (and the threads it starts later) to the given cpus."""
+    if not hasattr(os, 'sched_setaffinity'):
+        print("CPU affinity is not supported on this platform, ignoring")
+        return
+    os.sched_setaffinity(0, cpus)
+
+
+def configure_runtime(intra_op_threads=None, inter_op_threads=None, onednn=None, cpus=None):
+    """
+    Apply the thread, oneDNN and affinity settings for this process.
+    Arguments left as None fall back to the STOCK_* environment variables and
+    then to the TensorFlow defaults. Must be called before keras builds a model,
+    the oneDNN switch only takes effect if TensorFlow is not imported yet.
+    """
+    settings = get_runtime_settings()
+    if intra_op_threads is None:
+        intra_op_threads = settings['intra_op_threads']
+    if inter_op_threads is None:
+        inter_op_threads = settings['inter_op_threads']
+    if onednn is None:
+        onednn = settings['onednn']
+    if cpus is None:
+        cpus = settings['cpus']
+
+    if cpus:
+        set_cpu_affinity(cpus)
+        # Without an explicit thread count use one intra-op thread per pinned cpu
+        if intra_op_threads is None:
+            intra_op_threads = len(cpus)
+
+    if onednn is not None:
+        if 'tensorflow' in sys.modules:
+            print("TensorFlow already imported, STOCK_ONEDNN setting ignored")
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = '1' if onednn else '0'
+    if intra_op_threads:
+        # OpenMP pools inside oneDNN/MKL size themselves from this variable
+        os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+
+    import tensorflow as tf
+
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        # Raised once the TF runtime has been initialised in this process
+        print(f"Could not change TensorFlow threading: {str(e)}")
+
+    return {
+        'intra_op_threads': tf.config.threading.get_intra_op_parallelism_threads(),
+        'inter_op_threads': tf.config.threading.get_inter_op_parallelism_threads(),
+        'onednn': os.getenv('TF_ENABLE_ONEDNN_OPTS'),
+        'cpus': available_cpus(),
+    }
+
+
+def autotune_batch_size(model, x, y=None, candidates=BATCH_SIZE_CANDIDATES, repeats=3, verbose=False):
+    """
+    Time the model on each candidate batch size and return the one with the
+    highest samples/second. With y the timing uses train_on_batch on a
+    freshly compiled clone, so neither the weights nor the optimizer state
+    of `model` change; otherwise predict_on_batch on the model itself.
+    """
+    candidates = [size for size in candidates if size <= len(x)] or [len(x)]
+    if y is not None:
+        from keras.models import clone_model
+
+        trial = clone_model(model)
+        trial.set_weights(model.get_weights())
+        optimizer = model.optimizer.__class__.from_config(model.optimizer.get_config())
+        trial.compile(optimizer=optimizer, loss=model.loss)
+    best_size, best_rate = candidates[0], 0.0
+
+    for size in candidates:
+        xb = x[:size]
+        yb = y[:size] if y is not None else None
+        # First call traces the graph for this shape, keep it out of the timing
+        step = (lambda: trial.train_on_batch(xb, yb)) if y is not None else (lambda: model.predict_on_batch(xb))
+        step()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            step()
+        rate = size * repeats / (time.perf_counter() - start)
+        if verbose:
+            print(f"Batch size: {size}, samples/s: {rate:.1f}")
+        if rate > best_rate:
+            best_size, best_rate = size, rate
+
+    return best_size
+
+
+def resolve_batch_size(model=None, x=None, y=None, default=DEFAULT_BATCH_SIZE, verbose=False):
+    """
+    Batch size for training (y given) from STOCK_TRAIN_BATCH_SIZE, otherwise
+    for inference from STOCK_PREDICT_BATCH_SIZE; autotuned when set to "auto".
+    """
+    settings = get_runtime_settings()
+    value = settings['train_batch_size'] if y is not None else settings['predict_batch_size']
+    if value is None:
+        return default
+    if value == 'auto':
+        if model is None or x is None:
+            return default
+        return autotune_batch_size(model, x, y, verbose=verbose)
+    return int(value)
+
+
+def _benchmark_worker(intra_op_threads, inter_op_threads, onednn, window=60, samples=2048, batch_size=64):
+    """Train and predict a small stacked LSTM once, return samples/s for both."""
+    configure_runtime(intra_op_threads, inter_op_threads, onednn)
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dropout, Dense
+
+    rng = np.random.default_rng(0)
+    x = rng.random((samples, window, 1), dtype=np.float32)
+    y = rng.random(samples, dtype=np.float32)
+
+    model = Sequential()
+    model.add(LSTM(units=50, return_sequences=True, input_shape=(window, 1)))
+    model.add(Dropout(0.2))
+    model.add(LSTM(units=50))
+    model.add(Dropout(0.2))
+    model.add(Dense(units=1))
+    model.compile(optimizer='adam', loss='mean_squared_error')
+
+    # Warm-up epoch so graph tracing is not counted
+    model.fit(x[:batch_size * 2], y[:batch_size * 2], epochs=1, batch_size=batch_size, verbose=0)
+    start = time.perf_counter()
+    model.fit(x, y, epochs=1, batch_size=batch_size, verbose=0)
+    train_rate = samples / (time.perf_counter() - start)
+
+    model.predict(x[:batch_size], batch_size=batch_size, verbose=0)
+    start = time.perf_counter()
+    model.predict(x, batch_size=batch_size * 4, verbose=0)
+    predict_rate = samples / (time.perf_counter() - start)
+    return train_rate, predict_rate
+
+
+def benchmark(thread_options=None, inter_options=(1, 2), onednn_options=(True, False)):
+    """
+    Try every combination of thread counts and oneDNN on this machine and
+    print the train/predict throughput of each. Each combination runs in a
+    fresh process because TF threading cannot change once initialised.
+    Returns the settings with the best training throughput.
+    """
+    n_cpus = len(available_cpus())
+    if thread_options is None:
+        thread_options = sorted({1, 2, 4, max(1, n_cpus // 2), n_cpus})
+
+    results = []
+    for intra, inter, onednn in itertools.product(thread_options, inter_options, onednn_options):
+        cmd = [sys.executable, __file__, '--worker', str(intra), str(inter), '1' if onednn else '0']
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"Benchmark failed for intra={intra}, inter={inter}, onednn={onednn}")
+            print(proc.stderr[-2000:])
+            continue
+        train_rate, predict_rate = map(float, proc.stdout.strip().splitlines()[-1].split())
+        results.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'onednn': onednn,
+                        'train_samples_per_s': train_rate, 'predict_samples_per_s': predict_rate})
+        print(f"intra={intra:>3} inter={inter:>2} onednn={int(onednn)} "
+              f"train={train_rate:10.1f}/s predict={predict_rate:10.1f}/s")
+
+    if not results:
+        return None
+    best = max(results, key=lambda r: r['train_samples_per_s'])
+    print(f"Best settings: STOCK_INTRA_OP_THREADS={best['intra_op_threads']} "
+          f"STOCK_INTER_OP_THREADS={best['inter_op_threads']} STOCK_ONEDNN={int(best['onednn'])}")
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == '--worker':
+        rates = _benchmark_worker(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] == '1')
+        print(f"{rates[0]} {rates[1]}")
+    else:
+        benchmark()
@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline import STAGES, STAGE_FUNCTIONS, ticker_dir
+from resample import interval_ns
+from runtime_config import available_cpus
+
+# How many tasks of each stage may run at the same time. Fetching is network
+# bound, training is the CPU heavy part and gets the fewest slots.
+DEFAULT_STAGE_LIMITS = {
+    'fetch': 8,
+    'features': 4,
+    'train': 2,
+    'predict': 4,
+    'evaluate': 8,
+}
+
+
+def read_universe(path):
+    """
+    Tickers from a universe file, one per line. Blank lines and lines starting
+    with '#' are skipped, for CSV files only the first column is used.
+    """
+    tickers = []
+    seen = set()
+    with open(path) as f:
+        for line in f:
+            ticker = line.split('#', 1)[0].split(',', 1)[0].strip()
+            if not ticker or ticker.lower() in ('ticker', 'symbol'):
+                continue
+            if ticker.lower() not in seen:
+                seen.add(ticker.lower())
+                tickers.append(ticker)
+    return tickers
+
+
+# Stages that run TensorFlow and share the cores between them
+TF_STAGES = ('train', 'predict')
+
+
+def marker_path(artifacts, ticker, stage, state='done', interval=None):
+    # Only builds the path, checking for a marker must not create ticker directories
+    name = stage if interval is None else f"{stage}_{interval}"
+    return os.path.join(artifacts, ticker.lower(), f"{name}.{state}")
+
+
+def run_task(ticker, stage, artifacts, interval=None):
+    """Run one stage for one ticker in a worker process and record the outcome on disk."""
+    ticker_dir(artifacts, ticker)
+    # The outputs of this stage and of every later one are about to change,
+    # a resume after a failure must not trust their old done markers
+    for later in STAGES[STAGES.index(stage):]:
+        done = marker_path(artifacts, ticker, later, interval=interval)
+        if os.path.exists(done):
+            os.remove(done)
+    failed = marker_path(artifacts, ticker, stage, 'failed', interval)
+    try:
+        STAGE_FUNCTIONS[stage](ticker, artifacts, interval=interval)
+    except Exception:
+        with open(failed, 'w') as f:
+            f.write(traceback.format_exc())
+        raise
+    if os.path.exists(failed):
+        os.remove(failed)
+    # The done marker is written last, a task without it is rerun on resume
+    open(marker_path(artifacts, ticker, stage, interval=interval), 'w').close()
+
+
+class TaskGraph:
+    """
+    Stages of every ticker as a dependency chain: a task becomes ready once
+    the previous stage of the same ticker is done. Finished tasks are taken
+    from the done markers in the artifacts directory, so a rerun resumes.
+    """
+
+    def __init__(self, tickers, artifacts, stages=STAGES, interval=None):
+        self.stages = list(stages)
+        self.ready = {stage: deque() for stage in self.stages}
+        self.done = 0
+        self.waiting = 0
+        self.failed = []
+        self.blocked = []
+        for ticker in tickers:
+            # A ticker resumes from its first stage without a done marker,
+            # everything after it is rerun because its inputs change
+            for position, stage in enumerate(self.stages):
+                if not os.path.exists(marker_path(artifacts, ticker, stage, interval=interval)):
+                    self.ready[stage].append(ticker)
+                    self.waiting += len(self.stages) - position - 1
+                    break
+                self.done += 1
+        self.total = len(tickers) * len(self.stages)
+
+    @property
+    def pending(self):
+        return self.waiting + sum(len(queue) for queue in self.ready.values())
+
+    def next_task(self, per_stage, limits):
+        """
+        Pop a ready task whose stage is below its concurrency limit. Later
+        stages go first so tickers finish end to end instead of piling up
+        half-done artifacts.
+        """
+        for stage in reversed(self.stages):
+            if self.ready[stage] and per_stage[stage] < limits[stage]:
+                return self.ready[stage].popleft(), stage
+        return None
+
+    def requeue(self, task):
+        """Put back a task that was taken but never started."""
+        ticker, stage = task
+        self.ready[stage].appendleft(ticker)
+
+    def finish(self, task, ok):
+        ticker, stage = task
+        position = self.stages.index(stage)
+        later = self.stages[position + 1:]
+        if ok:
+            self.done += 1
+            if later:
+                self.waiting -= 1
+                self.ready[later[0]].append(ticker)
+            return
+        self.failed.append(task)
+        # Later stages of a failed ticker cannot run in this pass
+        self.waiting -= len(later)
+        self.blocked.extend((ticker, stage) for stage in later)
+
+
+def _progress(graph, running, started, skipped):
+    finished = graph.done - skipped
+    elapsed = time.time() - started
+    remaining = graph.pending + len(running)
+    eta = elapsed / finished * remaining if finished else float('nan')
+    print(f"[{elapsed:7.1f}s] done {graph.done}/{graph.total}, running {len(running)}, "
+          f"failed {len(graph.failed)}, blocked {len(graph.blocked)}, ETA {eta:.0f}s", flush=True)
+
+
+def run(tickers, artifacts, workers=None, stage_limits=None, stages=STAGES, interval=None):
+    """
+    Run the stages for all tickers on a local process pool, on hourly bars
+    or on bars resampled to `interval`. Returns the tasks that failed or
+    were blocked by a failure; rerunning the same command retries only those.
+    """
+    # The affinity mask, not the host, bounds the cores on a pinned or containerized node
+    n_cpus = len(available_cpus())
+    workers = workers or n_cpus
+    limits = {stage: DEFAULT_STAGE_LIMITS.get(stage, workers) for stage in stages}
+    limits.update(stage_limits or {})
+    if any(limit < 1 for limit in limits.values()):
+        raise ValueError(f"Stage limits must be at least 1: {limits}")
+    tf_slots = sum(limits[stage] for stage in TF_STAGES if stage in limits)
+    if tf_slots:
+        # Split the cores between all TensorFlow tasks that can run at once
+        # unless the caller chose a thread count; spawned workers inherit it
+        os.environ.setdefault('STOCK_INTRA_OP_THREADS', str(max(1, n_cpus // tf_slots)))
+
+    # One run id for all tickers so the results store can compare runs
+    from results_store import new_run_id
+    os.environ.setdefault('STOCK_RUN_ID', new_run_id())
+    print(f"Run id: {os.environ['STOCK_RUN_ID']}")
+
+    graph = TaskGraph(tickers, artifacts, stages, interval)
+    skipped = graph.done
+    if skipped:
+        print(f"Resuming: {skipped} of {graph.total} tasks already done")
+
+    running = {}
+    per_stage = {stage: 0 for stage in graph.stages}
+    started = time.time()
+    # spawn so every worker starts TensorFlow from a clean state
+    context = multiprocessing.get_context('spawn')
+
+    def collect(futures):
+        broken = False
+        for future in futures:
+            task = running.pop(future)
+            per_stage[task[1]] -= 1
+            error = future.exception()
+            if error is not None:
+                print(f"Error in {task[1]} for {task[0]}: {str(error)}")
+                broken = broken or isinstance(error, BrokenProcessPool)
+            graph.finish(task, error is None)
+        return broken
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        while graph.pending or running:
+            broken = False
+            while len(running) < workers:
+                task = graph.next_task(per_stage, limits)
+                if task is None:
+                    break
+                ticker, stage = task
+                try:
+                    future = pool.submit(run_task, ticker, stage, artifacts, interval)
+                except BrokenProcessPool:
+                    graph.requeue(task)
+                    broken = True
+                    break
+                per_stage[stage] += 1
+                running[future] = task
+
+            if not running and not broken:
+                break
+            if running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = collect(finished) or broken
+
+            if broken:
+                # A worker killed by the OOM killer or a crash inside TensorFlow
+                # breaks the whole pool: the tasks still in it are lost, so they
+                # count as failed and the remaining ones go to a fresh pool
+                wait(running)
+                collect(list(running))
+                pool.shutdown()
+                print("A worker process died, restarting the process pool")
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _progress(graph, running, started, skipped)
+    finally:
+        pool.shutdown()
+
+    return graph.failed + graph.blocked
+
+
+def _parse_limits(values):
+    limits = {}
+    for value in values or []:
+        stage, _, limit = value.partition('=')
+        if stage not in STAGES or not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f"Invalid stage limit: {value}, expected STAGE=N with N >= 1")
+        limits[stage] = int(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline for a universe of tickers")
+    parser.add_argument('universe', help="file with one ticker per line")
+    parser.add_argument('--artifacts', default='artifacts', help="directory the stages exchange files in")
+    parser.add_argument('--workers', type=int, default=None, help="size of the process pool")
+    parser.add_argument('--limit', action='append', metavar='STAGE=N',
+                        help="maximum concurrent tasks of a stage, e.g. train=2")
+    parser.add_argument('--stages', default=','.join(STAGES), help="comma separated stages to run")
+    parser.add_argument('--interval', default=None,
+                        help="run on bars resampled from the minute store, e.g. 5m, 15m or session")
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    try:
+        limits = _parse_limits(args.limit)
+        if args.interval is not None:
+            interval_ns(args.interval)
+    except ValueError as e:
+        parser.error(str(e))
+
+    tickers = read_universe(args.universe)
+    print(f"Scheduling {len(stages)} stages for {len(tickers)} tickers")
+    incomplete = run(tickers, args.artifacts, args.workers, limits, stages, args.interval)
+    if incomplete:
+        print(f"{len(incomplete)} tasks did not complete, rerun to resume")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()